@@ -1,12 +1,78 @@
-from sys import settrace, gettrace, stdout
-from inspect import ismethod, isfunction
-from linecache import getline
+from sys import (
+    settrace,
+    gettrace,
+    stdout,
+    version_info,
+    prefix,
+    base_prefix,
+    exec_prefix,
+    getallocatedblocks,
+)
+from types import FunctionType, MethodType
+from linecache import getlines
 from cmd import Cmd
+from collections import deque
+from functools import wraps
+from itertools import islice
+from threading import local
 from traceback import print_exception
 from os import path
-from re import match
-from ast import NodeVisitor, parse
-from collections import Counter, deque
+from re import compile as compile_regex
+from reprlib import Repr
+from site import getsitepackages
+from weakref import WeakKeyDictionary
+
+_USE_MONITORING = version_info >= (3, 12)
+if _USE_MONITORING:
+    from sys import monitoring, _getframe
+
+    _MON_TOOL_ID = monitoring.DEBUGGER_ID
+    _MON_EVENTS = monitoring.events
+    # What a traced code object receives; JUMP and PY_RETURN mirror settrace's local tracer.
+    _MON_TRACED = _MON_EVENTS.LINE | _MON_EVENTS.JUMP | _MON_EVENTS.PY_RETURN
+
+_LIBRARY_PREFIXES = (
+    *(
+        path.join(path.abspath(p), "")
+        for p in {prefix, base_prefix, exec_prefix, *getsitepackages()}
+    ),
+    "<frozen ",  # Frozen stdlib modules (importlib, os, ...) have no file path at all
+)
+_HEAP_SAMPLE_SIZE = 50000  # Objects 'info heap full' inspects at most
+_SETVAR_RE = compile_regex(r"^\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*(.*)$")
+_short_repr = Repr(  # Bounds 'info locals/globals' output per value, whatever its size
+    maxstring=200,
+    maxother=200,
+    maxlist=10,
+    maxtuple=10,
+    maxdict=10,
+    maxset=10,
+    maxfrozenset=10,
+    maxdeque=10,
+)
+_SR = _short_repr.repr
+
+# What compile() raises for bad user source: invalid syntax, null bytes (ValueError before
+# 3.12), and expressions too deep for the parser or compiler.
+_COMPILE_ERRORS = (SyntaxError, ValueError, MemoryError, RecursionError)
+
+
+def _offset_line(code, offset):
+    """Source line of the instruction at byte offset in code, or None."""
+    for start, end, line in code.co_lines():
+        if start <= offset < end:
+            return line
+    return None
+
+
+def _write_back_locals(frame):
+    """Copies edits made to frame.f_locals into the frame's real (fast) locals."""
+    # Only settrace does this implicitly, and only for the traced frame; since 3.13
+    # f_locals is a write-through proxy and there is nothing to copy.
+    if version_info < (3, 13):
+        from ctypes import c_int, py_object, pythonapi
+
+        pythonapi.PyFrame_LocalsToFast(py_object(frame), c_int(0))
 
 
 class _TermColors:
@@ -22,953 +88,1331 @@ class _TermColors:
     GREY = "\033[90m"
 
 
-def debug_function(obj_to_debug):
-    """
-    A decorator that enables a GDB-like debugger for the decorated function or method.
-    Activates upon function/method entry. If applied to a class, it currently does not
-    automatically decorate its methods; methods should be decorated individually.
-    """
+# Pre-bound palette; empty when output is not a terminal, so piped output stays plain.
+# stdout is None under pythonw or a detached daemon, and replacements may lack isatty.
+_H, _BL, _CY, _G, _Y, _R, _E, _B, _GY = (
+    (
+        _TermColors.HEADER,
+        _TermColors.OKBLUE,
+        _TermColors.OKCYAN,
+        _TermColors.OKGREEN,
+        _TermColors.WARNING,
+        _TermColors.FAIL,
+        _TermColors.ENDC,
+        _TermColors.BOLD,
+        _TermColors.GREY,
+    )
+    if getattr(stdout, "isatty", lambda: False)()
+    else ("",) * 9
+)
+
+
+class _BreakpointInfo:
+    """Stores information and state for a single breakpoint."""
+
+    def __init__(
+        self, bp_id, lineno, file_abs, condition_str=None, initial_ignore_count=0
+    ):
+        self.id = bp_id
+        self.lineno = lineno
+        self.file_abs = file_abs
+        self.condition_str = condition_str
+        self.condition_code = (
+            compile(condition_str, f"<bp cond {lineno}>", "eval")
+            if condition_str
+            else None
+        )
+        self.initial_ignore_count = initial_ignore_count
+        self.current_ignore_left = initial_ignore_count
+        self.hit_count = 0
+        self.enabled = True
+        self.specialize()
+
+    def __repr__(self):
+        return (
+            f"_BreakpointInfo(id={self.id}, lineno={self.lineno}, file='{path.basename(self.file_abs)}', "
+            f"cond='{self.condition_str}', ignore={self.current_ignore_left}/{self.initial_ignore_count}, "
+            f"hits={self.hit_count}, enabled={self.enabled})"
+        )
+
+    def specialize(self):
+        """Binds should_stop to the variant with only the checks this breakpoint needs.
+
+        Must be called again whenever the ignore count changes.
+        """
+        if self.current_ignore_left > 0:
+            self.should_stop = self._should_stop_ignore
+        elif self.condition_code:
+            self.should_stop = self._should_stop_cond
+        else:
+            self.should_stop = self._should_stop_plain
 
-    class _BreakpointInfo:
-        """Stores information and state for a single breakpoint."""
+    def _eval_condition(self, frame):
+        try:
+            return bool(eval(self.condition_code, frame.f_globals, frame.f_locals))
+        except Exception as e:
+            print(f"{_Y}Err evaluating BP condition '{self.condition_str}': {e}{_E}")
+            return False
 
-        def __init__(
-            self, lineno, file_abs, condition_str=None, initial_ignore_count=0
-        ):
-            self.lineno = lineno
-            self.file_abs = file_abs
-            self.condition_str = condition_str
-            self.initial_ignore_count = initial_ignore_count
-            self.current_ignore_left = initial_ignore_count
-            self.hit_count = 0
-            self.enabled = True
-
-        def __repr__(self):
-            return (
-                f"_BreakpointInfo(lineno={self.lineno}, file='{path.basename(self.file_abs)}', "
-                f"cond='{self.condition_str}', ignore={self.current_ignore_left}/{self.initial_ignore_count}, "
-                f"hits={self.hit_count}, enabled={self.enabled})"
-            )
+    def _should_stop_plain(self, frame):
+        if not self.enabled:
+            return False
+        self.hit_count += 1
+        return True
 
-        def should_stop(self, frame_globals, frame_locals):
-            if not self.enabled:
-                return False
-            self.hit_count += 1
-            if self.current_ignore_left > 0:
-                self.current_ignore_left -= 1
-                return False
-            if self.condition_str:
-                try:
-                    return bool(eval(self.condition_str, frame_globals, frame_locals))
-                except Exception as e:
-                    print(
-                        f"{_TermColors.WARNING}Err evaluating BP condition '{self.condition_str}': {e}{_TermColors.ENDC}"
-                    )
-                    return False
-            return True
+    def _should_stop_cond(self, frame):
+        if not self.enabled:
+            return False
+        self.hit_count += 1
+        return self._eval_condition(frame)
 
-    class _BreakpointManager:
-        """Manages all breakpoint operations, including AST parsing and caching for function name resolution."""
-
-        def __init__(self):
-            self.breakpoints_by_file = {}
-            self.ast_cache = {}
-            self.next_bp_id = 1
-            self.breakpoints_by_id = {}
-
-        class _FunctionFinder(NodeVisitor):
-            def __init__(self, func_name_parts):
-                self.func_name_parts = func_name_parts
-                self.target_lineno = None
-                self._current_path = []
-
-            def visit_FunctionDef(self, node):
-                self._current_path.append(node.name)
-                if (
-                    len(self._current_path) == len(self.func_name_parts)
-                    and self._current_path == self.func_name_parts
-                ):
-                    self.target_lineno = node.lineno
-                if (
-                    not self.target_lineno
-                    and len(self._current_path) < len(self.func_name_parts)
-                    and self.func_name_parts[: len(self._current_path)]
-                    == self._current_path
-                ):
-                    self.generic_visit(node)
-                self._current_path.pop()
-
-            def visit_AsyncFunctionDef(self, node):
-                self.visit_FunctionDef(node)
-
-            def visit_ClassDef(self, node):
-                self._current_path.append(node.name)
-                if (
-                    len(self._current_path) <= len(self.func_name_parts)
-                    and self.func_name_parts[: len(self._current_path)]
-                    == self._current_path
-                ):
-                    self.generic_visit(node)
-                self._current_path.pop()
-
-        def _load_ast_with_cache(self, filename_abs):
-            try:
-                mtime = path.getmtime(filename_abs)
-                if (
-                    filename_abs in self.ast_cache
-                    and mtime == self.ast_cache[filename_abs][0]
-                ):
-                    return self.ast_cache[filename_abs][1]
-                with open(filename_abs, "r", encoding="utf-8") as f:
-                    source_code = f.read()
-                tree = parse(source_code, filename=filename_abs)
-                self.ast_cache[filename_abs] = (mtime, tree)
-                return tree
-            except (FileNotFoundError, SyntaxError, Exception):
-                return None
-
-        def _find_func_lineno_using_ast(self, filename_abs, func_spec):
-            tree = self._load_ast_with_cache(filename_abs)
-            _ = tree or (_FunctionFinder([]).target_lineno)  # type: ignore
-            if not tree:
-                return None
-            finder = self._FunctionFinder(func_spec.split("."))
-            finder.visit(tree)
-            return finder.target_lineno
-
-        def parse_location_string(self, loc_str, current_file_for_context):
-            file_part_str, loc_part_str = (
-                loc_str.rsplit(":", 1)
-                if ":" in loc_str
-                else (current_file_for_context, loc_str)
-            )
-            abs_file_path = path.abspath(file_part_str)
-            try:
-                return abs_file_path, int(loc_part_str)
-            except ValueError:
-                lineno = self._find_func_lineno_using_ast(abs_file_path, loc_part_str)
-                return (abs_file_path, lineno) if lineno else (None, None)
+    def _should_stop_ignore(self, frame):
+        if not self.enabled:
+            return False
+        self.hit_count += 1
+        self.current_ignore_left -= 1
+        if not self.current_ignore_left:
+            self.specialize()  # Condition (if any) applies from the next hit
+        return False
 
-        def add_breakpoint(
-            self, file_abs, lineno, condition_str=None, initial_ignore_count=0
-        ):
-            if file_abs not in self.breakpoints_by_file:
-                self.breakpoints_by_file[file_abs] = {}
-            bp_info = _BreakpointInfo(
-                lineno, file_abs, condition_str, initial_ignore_count
-            )
-            self.breakpoints_by_file[file_abs][lineno] = bp_info
-            bp_id = self.next_bp_id
-            self.next_bp_id += 1
-            self.breakpoints_by_id[bp_id] = bp_info
-            print(
-                f"Breakpoint {bp_id} set at {path.basename(file_abs)}:{lineno}"
-                + (f" if {condition_str}" if condition_str else "")
-                + (
-                    f" (ignore next {initial_ignore_count} hits)"
-                    if initial_ignore_count > 0
-                    else ""
-                )
-            )
-            return bp_id
 
-        def clear_breakpoint(self, bp_id_or_loc_str, current_file_for_context):
-            bp_to_remove_id = (
-                bp_id_or_loc_str if isinstance(bp_id_or_loc_str, int) else None
-            )
-            if not bp_to_remove_id:
-                file_abs, lineno = self.parse_location_string(
-                    bp_id_or_loc_str, current_file_for_context
-                )
-                if (
-                    file_abs
-                    and lineno
-                    and file_abs in self.breakpoints_by_file
-                    and lineno in self.breakpoints_by_file[file_abs]
-                ):
-                    bp_info = self.breakpoints_by_file[file_abs][lineno]
-                    for bp_id, info in self.breakpoints_by_id.items():
-                        if info == bp_info:
-                            bp_to_remove_id = bp_id
-                            break
-                else:
-                    return False
-            if bp_to_remove_id and bp_to_remove_id in self.breakpoints_by_id:
-                bp_info = self.breakpoints_by_id.pop(bp_to_remove_id)
-                del self.breakpoints_by_file[bp_info.file_abs][bp_info.lineno]
-                if not self.breakpoints_by_file[bp_info.file_abs]:
-                    del self.breakpoints_by_file[bp_info.file_abs]
-                print(f"Breakpoint {bp_to_remove_id} cleared.")
-                return True
-            return False
+class _FunctionIndexer:
+    """Maps every dotted def path ("Class.method", "outer.inner") to its first body line.
 
-        def clear_all_breakpoints(self):
-            self.breakpoints_by_file.clear()
-            self.breakpoints_by_id.clear()
-            print("All breakpoints cleared.")
+    Callees get no event on their def line, so a breakpoint there would never fire.
+
+    A minimal ast.NodeVisitor equivalent, so ast is only imported when a name is resolved.
+    """
 
-        def check_breakpoint(self, file_abs, lineno, frame_globals, frame_locals):
+    def __init__(self):
+        self.func_index = {}
+        self._current_path = []
+
+    def visit(self, node):
+        getattr(self, "visit_" + node.__class__.__name__, self.generic_visit)(node)
+
+    def generic_visit(self, node):
+        from ast import iter_child_nodes
+
+        for child in iter_child_nodes(node):
+            self.visit(child)
+
+    def visit_FunctionDef(self, node):
+        self._current_path.append(node.name)
+        self.func_index[".".join(self._current_path)] = self._first_body_line(node)
+        self.generic_visit(node)
+        self._current_path.pop()
+
+    @staticmethod
+    def _first_body_line(node):
+        """First line that runs in node's body, skipping a docstring; the def line if none."""
+        from ast import Constant, Expr
+
+        body = node.body
+        if (
+            isinstance(body[0], Expr)
+            and isinstance(body[0].value, Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            body = body[1:]
+        if not body:
+            return node.lineno
+        # A decorated def or class starts running at its first decorator.
+        decorators = getattr(body[0], "decorator_list", ())
+        return min([body[0].lineno] + [d.lineno for d in decorators])
+
+    def visit_AsyncFunctionDef(self, node):
+        self.visit_FunctionDef(node)
+
+    def visit_ClassDef(self, node):
+        self._current_path.append(node.name)
+        self.generic_visit(node)
+        self._current_path.pop()
+
+
+class _BreakpointManager:
+    """Manages all breakpoint operations, including AST parsing and caching for function name resolution."""
+
+    def __init__(self):
+        self.breakpoints_by_file = {}
+        self.breakpoints_by_filename = {}  # co_filename -> that file's {lineno: bp}
+        # code -> frozenset of its own lines, for files with breakpoints; weak, so finished
+        # code (exec'd or reloaded functions) is not kept alive by the cache.
+        self.code_lines = WeakKeyDictionary()
+        self.file_line_index = {}  # file_abs -> frozenset of breakpoint lines
+        self.ast_cache = {}
+        self.next_bp_id = 1
+        self.breakpoints_by_id = {}
+        self.abs_path_cache = {}
+        self.change_count = 0  # Bumped whenever the set of breakpoint locations changes
+
+    def abs_path(self, filename):
+        """Memoized path.abspath; equal inputs map to the identical key string.
+
+        Keyed by filename rather than code object: all code objects of a module share
+        one co_filename, so a single entry serves them, and no stale id() can alias.
+        """
+        file_abs = self.abs_path_cache.get(filename)
+        if file_abs is None:
+            file_abs = path.abspath(filename)
+            self.abs_path_cache[filename] = file_abs
+        return file_abs
+
+    def _load_func_index_with_cache(self, filename_abs):
+        try:
+            mtime = path.getmtime(filename_abs)
             if (
-                file_abs in self.breakpoints_by_file
-                and lineno in self.breakpoints_by_file[file_abs]
+                filename_abs in self.ast_cache
+                and mtime == self.ast_cache[filename_abs][0]
             ):
-                bp_info = self.breakpoints_by_file[file_abs][lineno]
-                if bp_info.should_stop(frame_globals, frame_locals):
-                    return bp_info
+                return self.ast_cache[filename_abs][1]
+            with open(filename_abs, "r", encoding="utf-8") as f:
+                source_code = f.read()
+            from ast import parse
+
+            indexer = _FunctionIndexer()
+            indexer.visit(parse(source_code, filename=filename_abs))
+            self.ast_cache[filename_abs] = (mtime, indexer.func_index)
+            return indexer.func_index
+        except (FileNotFoundError, SyntaxError, Exception):
             return None
 
-        def set_ignore_count(self, bp_id, count):
-            if bp_id in self.breakpoints_by_id:
-                bp_info = self.breakpoints_by_id[bp_id]
-                bp_info.initial_ignore_count = count
-                bp_info.current_ignore_left = count
-                print(f"BP {bp_id} will ignore {count} hits.")
-                return True
-            print(f"{_TermColors.WARNING}BP ID {bp_id} not found.{_TermColors.ENDC}")
-            return False
-
-        def list_breakpoints(self):
-            if not self.breakpoints_by_id:
-                print("  No breakpoints set.")
-                return
-            print(
-                f"{_TermColors.HEADER}Breakpoints:{_TermColors.ENDC}\n  ID  Enb Hits Ignore Condition                           Location\n  --- --- ---- ------ ----------------------------------- --------------------"
+    def _find_func_lineno_using_ast(self, filename_abs, func_spec):
+        func_index = self._load_func_index_with_cache(filename_abs)
+        return func_index.get(func_spec) if func_index else None
+
+    def parse_location_string(self, loc_str, current_file_for_context):
+        file_part_str, loc_part_str = (
+            loc_str.rsplit(":", 1)
+            if ":" in loc_str
+            else (current_file_for_context, loc_str)
+        )
+        abs_file_path = self.abs_path(file_part_str)
+        try:
+            return abs_file_path, int(loc_part_str)
+        except ValueError:
+            lineno = self._find_func_lineno_using_ast(abs_file_path, loc_part_str)
+            return (abs_file_path, lineno) if lineno else (None, None)
+
+    def add_breakpoint(
+        self, file_abs, lineno, condition_str=None, initial_ignore_count=0
+    ):
+        bp_id = self.next_bp_id
+        bp_info = _BreakpointInfo(
+            bp_id, lineno, file_abs, condition_str, initial_ignore_count
+        )
+        self.next_bp_id += 1
+        if file_abs not in self.breakpoints_by_file:
+            self.breakpoints_by_file[file_abs] = {}
+            self.breakpoints_by_filename.clear()
+        replaced = self.breakpoints_by_file[file_abs].get(lineno)
+        if replaced:
+            # One breakpoint per location: the old id must not keep pointing here.
+            del self.breakpoints_by_id[replaced.id]
+        self.breakpoints_by_file[file_abs][lineno] = bp_info
+        self.file_line_index[file_abs] = frozenset(self.breakpoints_by_file[file_abs])
+        self.breakpoints_by_id[bp_id] = bp_info
+        self.change_count += 1
+        print(
+            f"Breakpoint {bp_id} set at {path.basename(file_abs)}:{lineno}"
+            + (f" if {condition_str}" if condition_str else "")
+            + (
+                f" (ignore next {initial_ignore_count} hits)"
+                if initial_ignore_count > 0
+                else ""
             )
-            for bp_id, bp in sorted(self.breakpoints_by_id.items()):
-                print(
-                    f"  {bp_id:<3} {'y' if bp.enabled else 'n':<3} {bp.hit_count:<4} {str(bp.current_ignore_left)+'/'+str(bp.initial_ignore_count):<6} {(bp.condition_str or ''):<35.35} {path.basename(bp.file_abs)}:{bp.lineno}"
+        )
+        return bp_id
+
+    def clear_breakpoint(self, bp_id_or_loc_str, current_file_for_context):
+        bp_to_remove_id = (
+            bp_id_or_loc_str if isinstance(bp_id_or_loc_str, int) else None
+        )
+        if not bp_to_remove_id:
+            file_abs, lineno = self.parse_location_string(
+                bp_id_or_loc_str, current_file_for_context
+            )
+            bp_info = self.breakpoints_by_file.get(file_abs, {}).get(lineno)
+            if not bp_info:
+                return False
+            bp_to_remove_id = bp_info.id
+        if bp_to_remove_id and bp_to_remove_id in self.breakpoints_by_id:
+            bp_info = self.breakpoints_by_id.pop(bp_to_remove_id)
+            del self.breakpoints_by_file[bp_info.file_abs][bp_info.lineno]
+            if not self.breakpoints_by_file[bp_info.file_abs]:
+                del self.breakpoints_by_file[bp_info.file_abs]
+                del self.file_line_index[bp_info.file_abs]
+                self.breakpoints_by_filename.clear()
+                self.code_lines.clear()
+            else:
+                self.file_line_index[bp_info.file_abs] = frozenset(
+                    self.breakpoints_by_file[bp_info.file_abs]
                 )
-
-    class _StateManager:
-        """Manages the debugger's stepping state."""
-
-        def __init__(self):
-            self.request_stop_at_next_suitable_event = True  # True for initial entry
-            self.step_into = False
-            self.step_over = False
-            self.step_over_target_depth = -1
-            self.step_out = False
-            self.step_out_target_depth = -1
-            self.run_until_line_info = None
-
-        def reset_stepping_flags(self):
-            self.step_into = False
-            self.step_over = False
-            self.step_out = False
-
-        def configure_for_run(self):
-            self.request_stop_at_next_suitable_event = False
-            self.reset_stepping_flags()
-            self.run_until_line_info = None
-
-        def configure_for_step_into(self):
-            self.request_stop_at_next_suitable_event = True
-            self.step_into = True
-            self.step_over = False
-            self.step_out = False
-            self.run_until_line_info = None
-
-        def configure_for_step_over(self, depth):
-            self.request_stop_at_next_suitable_event = True
-            self.step_over = True
-            self.step_into = False
-            self.step_out = False
-            self.step_over_target_depth = depth
-            self.run_until_line_info = None
-
-        def configure_for_step_out(self, depth):
-            self.request_stop_at_next_suitable_event = True
-            self.step_out = True
-            self.step_into = False
-            self.step_over = False
-            self.step_out_target_depth = depth
-            self.run_until_line_info = None
-
-        def configure_for_run_until(self, file, line):
-            self.request_stop_at_next_suitable_event = True
-            self.reset_stepping_flags()
-            self.run_until_line_info = (file, line)
-
-    class PyDebugger(Cmd):
-        """PyDebugger is the main debugger class, providing a command-line interface and managing debug sessions."""
-
-        prompt_template = f"({_TermColors.OKBLUE}pydbg{_TermColors.ENDC}) "
-        intro_message = f"{_TermColors.BOLD}Welcome to PyDebugger. Type 'help' or '?' for commands.{_TermColors.ENDC}"
-        current_line_marker = f"{_TermColors.OKGREEN}--->{_TermColors.ENDC} "
-
-        def __init__(self, entry_exec_frame):
-            super().__init__()
-            self.execution_frame = entry_exec_frame
-            self.interaction_frame = entry_exec_frame
-            self._full_stack_at_stop = []
-            self._interaction_stack_idx = 0
-            self.state_manager = _StateManager()  # Initial state requests stop
-            self.breakpoint_manager = _BreakpointManager()
-            self.watched_expressions = []
-            self.command_history = deque(maxlen=100)
-            self.last_non_empty_cmd = ""
-            self.quit_debugger = False
-            self.aliases = {
-                "n": "next",
-                "s": "step",
-                "c": "continue",
-                "q": "quit",
-                "bt": "backtrace",
-                "p": "printvar",
-                "b": "break",
-                "cl": "clear",
-                "l": "list",
-                "h": "help",
-                "set": "setvar",
-                "fin": "finish",
-                "until": "rununtil",
-                "up": "up_stack",
-                "down": "down_stack",
-                "info": "info",
-                "watch": "watch_expr",
-                "unwatch": "unwatch_expr",
-                "ignore": "ignore_breakpoint",
-            }
-            self._capture_full_stack(self.execution_frame)
-            self.update_prompt()
-            print(self.intro_message)
-            # Initial print_current_location and cmdloop are now deferred to the first trace_dispatch stop
-
-        def _get_frame_depth(self, frm):
+            self.change_count += 1
+            print(f"Breakpoint {bp_to_remove_id} cleared.")
+            return True
+        return False
+
+    def clear_all_breakpoints(self):
+        self.breakpoints_by_file.clear()
+        self.breakpoints_by_filename.clear()
+        self.code_lines.clear()
+        self.file_line_index.clear()
+        self.breakpoints_by_id.clear()
+        self.change_count += 1
+        print("All breakpoints cleared.")
+
+    def breakpoints_for_code(self, code):
+        """Returns the {lineno: bp} dict of code's file, cached per file name.
+
+        Keyed like abs_path, so the cache is bounded by the number of files and pins no code.
+        """
+        filename = code.co_filename
+        bps = self.breakpoints_by_filename.get(filename)
+        if bps is None:
+            bps = self.breakpoints_by_file.get(self.abs_path(filename), {})
+            self.breakpoints_by_filename[filename] = bps
+        return bps
+
+    def code_has_breakpoints(self, code):
+        """True if any line of code (excluding nested code objects) holds a breakpoint."""
+        bp_lines = self.file_line_index.get(self.abs_path(code.co_filename))
+        if not bp_lines:
+            return False
+        lines = self.code_lines.get(code)
+        if lines is None:
+            lines = frozenset(ln for _, _, ln in code.co_lines())
+            self.code_lines[code] = lines
+        return not bp_lines.isdisjoint(lines)
+
+    def check_breakpoint(self, frame):
+        # The frame is passed whole so f_locals is only materialized for conditions.
+        bp_info = self.breakpoints_for_code(frame.f_code).get(frame.f_lineno)
+        if bp_info and bp_info.should_stop(frame):
+            return bp_info
+        return None
+
+    def set_ignore_count(self, bp_id, count):
+        if bp_id in self.breakpoints_by_id:
+            bp_info = self.breakpoints_by_id[bp_id]
+            bp_info.initial_ignore_count = count
+            bp_info.current_ignore_left = count
+            bp_info.specialize()
+            print(f"BP {bp_id} will ignore {count} hits.")
+            return True
+        print(f"{_Y}BP ID {bp_id} not found.{_E}")
+        return False
+
+    def list_breakpoints(self):
+        if not self.breakpoints_by_id:
+            print("  No breakpoints set.")
+            return
+        buf = [
+            f"{_H}Breakpoints:{_E}\n  ID  Enb Hits Ignore Condition                           Location\n  --- --- ---- ------ ----------------------------------- --------------------\n"
+        ]
+        # Ids only grow and are inserted once, so dict order is already id order.
+        for bp_id, bp in self.breakpoints_by_id.items():
+            buf.append(
+                f"  {bp_id:<3} {'y' if bp.enabled else 'n':<3} {bp.hit_count:<4} {str(bp.current_ignore_left)+'/'+str(bp.initial_ignore_count):<6} {(bp.condition_str or ''):<35.35} {path.basename(bp.file_abs)}:{bp.lineno}\n"
+            )
+        print("".join(buf), end="")  # One write for the whole table
+
+
+class _StateManager:
+    """Manages the debugger's stepping state."""
+
+    def __init__(self):
+        self.request_stop_at_next_suitable_event = True  # True for initial entry
+        self.step_into = False
+        self.step_over = False
+        self.step_over_target_depth = -1
+        self.step_out = False
+        self.step_out_target_depth = -1
+        self.run_until_line_info = None
+
+    def reset_stepping_flags(self):
+        self.step_into = False
+        self.step_over = False
+        self.step_out = False
+
+    def configure_for_run(self):
+        self.request_stop_at_next_suitable_event = False
+        self.reset_stepping_flags()
+        self.run_until_line_info = None
+
+    def configure_for_step_into(self):
+        self.request_stop_at_next_suitable_event = True
+        self.step_into = True
+        self.step_over = False
+        self.step_out = False
+        self.run_until_line_info = None
+
+    def configure_for_step_over(self, depth):
+        self.request_stop_at_next_suitable_event = True
+        self.step_over = True
+        self.step_into = False
+        self.step_out = False
+        self.step_over_target_depth = depth
+        self.run_until_line_info = None
+
+    def configure_for_step_out(self, depth):
+        self.request_stop_at_next_suitable_event = True
+        self.step_out = True
+        self.step_into = False
+        self.step_over = False
+        self.step_out_target_depth = depth
+        self.run_until_line_info = None
+
+    def configure_for_run_until(self, file, line):
+        self.request_stop_at_next_suitable_event = True
+        self.reset_stepping_flags()
+        self.run_until_line_info = (file, line)
+
+
+class PyDebugger(Cmd):
+    """PyDebugger is the main debugger class, providing a command-line interface and managing debug sessions."""
+
+    prompt_template = f"({_BL}pydbg{_E}) "
+    intro_message = f"{_B}Welcome to PyDebugger. Type 'help' or '?' for commands.{_E}"
+    current_line_marker = f"{_G}--->{_E} "
+    # Frames whose file starts with one of these are never traced (stdlib, site-packages, frozen).
+    skip_prefixes = _LIBRARY_PREFIXES
+    history_size = 100
+
+    def __init__(self, entry_exec_frame):
+        super().__init__()
+        self.execution_frame = entry_exec_frame
+        self.interaction_frame = entry_exec_frame
+        self._stack_top = None
+        self._stack_cache = None
+        self._stack_idx_by_frame = {}
+        self._locals_cache = {}  # frame -> f_locals, valid for the current stop
+        self._interaction_stack_idx = 0
+        self._depth_frame = None  # Last frame _get_frame_depth saw; dropped on every resume
+        self._depth = 0
+        self.state_manager = _StateManager()  # Initial state requests stop
+        self.breakpoint_manager = _BreakpointManager()
+        self.watched_expressions = {}  # source -> compiled code, in watch order
+        self.command_history = deque(maxlen=self.history_size)
+        self.last_non_empty_cmd = ""
+        self._bp_dirty = False  # Breakpoint table changed since it was last shown
+        self.quit_debugger = False
+        self._armed = True  # Initial entry stop is pending
+        self._event_dispatch = {
+            "call": self._on_call_event,
+            "line": self._line_handler_default,
+            "exception": self._on_exception_event,
+        }
+        self._info_handlers = {
+            "locals": self._info_locals,
+            "globals": self._info_globals,
+            "breakpoints": self._info_breakpoints,
+            "stack": self._info_stack,
+            "heap": self._info_heap,
+            "heap full": self._info_heap_full,
+            "frame": self._info_frame,
+            "history": self._info_history,
+            "watch": self._info_watch,
+        }
+        self._monitoring = False
+        self._entry_code = entry_exec_frame.f_code
+        self._instrumented = set()
+        self._library_files = {}  # co_filename -> under skip_prefixes
+        # restart_events() is process-wide, so it only runs when one of our DISABLEs
+        # may now hide a stop: a silenced line or an unscanned code object.
+        self._lines_disabled = False
+        self._starts_disabled = False
+        self._synced_bp_changes = 0
+        self.aliases = {
+            "n": "next",
+            "s": "step",
+            "c": "continue",
+            "q": "quit",
+            "bt": "backtrace",
+            "p": "printvar",
+            "b": "break",
+            "cl": "clear",
+            "l": "list",
+            "h": "help",
+            "set": "setvar",
+            "fin": "finish",
+            "until": "rununtil",
+            "up": "up_stack",
+            "down": "down_stack",
+            "info": "info",
+            "watch": "watch_expr",
+            "unwatch": "unwatch_expr",
+            "ignore": "ignore_breakpoint",
+        }
+        self._capture_full_stack(self.execution_frame)
+        self.update_prompt()
+        print(self.intro_message)
+        # Initial print_current_location and cmdloop are now deferred to the first trace_dispatch stop
+
+    def _get_frame_depth(self, frm):
+        """Depth of frm, derived from the last frame seen when frm is it, its caller or its callee."""
+        cached_frm = self._depth_frame
+        if frm is cached_frm:
+            return self._depth
+        if cached_frm is not None and frm.f_back is cached_frm:
+            depth = self._depth + 1
+        elif cached_frm is not None and cached_frm.f_back is frm:
+            depth = self._depth - 1
+        else:
             depth = 0
             temp_frm = frm
             while temp_frm:
                 depth += 1
                 temp_frm = temp_frm.f_back
-            return depth
+        self._depth_frame = frm
+        self._depth = depth
+        return depth
+
+    def _capture_full_stack(self, most_recent_frame):
+        """Anchors the stack at most_recent_frame; the frame list itself is built on first use."""
+        self._stack_top = most_recent_frame
+        self._stack_cache = None
+        if most_recent_frame:
+            self._interaction_stack_idx = 0
+            self.interaction_frame = most_recent_frame
 
-        def _capture_full_stack(self, most_recent_frame):
-            self._full_stack_at_stop = []
-            frm = most_recent_frame
+    @property
+    def _full_stack_at_stop(self):
+        if self._stack_cache is None:
+            self._stack_cache = []
+            frm = self._stack_top
             while frm:
-                self._full_stack_at_stop.append(frm)
+                self._stack_cache.append(frm)
                 frm = frm.f_back
-            if (
-                self.execution_frame
-                and self.execution_frame in self._full_stack_at_stop
-            ):
-                self._interaction_stack_idx = self._full_stack_at_stop.index(
-                    self.execution_frame
-                )
-                self.interaction_frame = self.execution_frame
-            elif self._full_stack_at_stop:
-                self._interaction_stack_idx = 0
-                self.interaction_frame = self._full_stack_at_stop[0]
-
-        def update_prompt(self):
-            frm = self.interaction_frame
-            ind = ""
-            if frm:
-                if self.interaction_frame != self.execution_frame:
-                    ind = f" (inspecting frame {self._interaction_stack_idx})"
-                self.prompt = f"({_TermColors.OKBLUE}pydbg{_TermColors.ENDC} {_TermColors.GREY}{path.basename(frm.f_code.co_filename)}:{frm.f_lineno} {frm.f_code.co_name}(){ind}{_TermColors.ENDC}) "
-            else:
-                self.prompt = self.prompt_template
-
-        def print_current_location(self, frm, reason=""):
-            if not frm:
-                return
-            fn, ln, nm = frm.f_code.co_filename, frm.f_lineno, frm.f_code.co_name
-            if reason:
-                print(f"{_TermColors.GREY}{reason} at:{_TermColors.ENDC}")
-            idx = (
-                self._full_stack_at_stop.index(frm)
-                if self._full_stack_at_stop and frm in self._full_stack_at_stop
-                else "?"
-            )
-            print(
-                f" Frame {idx}: {_TermColors.BOLD}{path.basename(fn)}:{ln} {nm}(){_TermColors.ENDC}"
-            )
-            ctx = 5
-            sline = max(1, ln - (ctx // 2))
-            eline = sline + ctx - 1
-            for i in range(sline, eline + 1):
-                txt = getline(fn, i).rstrip("\n")
-                if txt:
-                    pfx = (
-                        self.current_line_marker
-                        if i == ln and frm == self.execution_frame
-                        else "     "
-                    )
-                    print(
-                        f" {pfx}{i:4d} {_TermColors.OKCYAN if i==ln else ''}{txt}{_TermColors.ENDC if i==ln else ''}"
-                    )
-            print()
-
-        def _print_watched_expressions(self):
-            if self.watched_expressions and self.interaction_frame:
-                print(
-                    f"{_TermColors.HEADER}Watched Expressions (frame {self._interaction_stack_idx}):{_TermColors.ENDC}"
-                )
-                for i, ex in enumerate(self.watched_expressions):
-                    try:
-                        v = eval(
-                            ex,
-                            self.interaction_frame.f_globals,
-                            self.interaction_frame.f_locals,
-                        )
-                        print(f"  {i}: {ex} = {repr(v)}")
-                    except Exception as e:
-                        print(f"  {i}: {ex} = Error: {e}")
-                print()
-
-        def trace_dispatch(self, frm, event, arg):
-            if self.quit_debugger:
-                settrace(None)
-                return None
-            self.execution_frame = frm
-
-            stop_now = self.state_manager.request_stop_at_next_suitable_event
-            self.state_manager.request_stop_at_next_suitable_event = (
-                False  # Assume continue, cmds will set True if needed
-            )
-
-            current_file_abs = path.abspath(frm.f_code.co_filename)
-            current_depth = self._get_frame_depth(frm)
-            reason_for_stop = (
-                "Initial entry" if stop_now else None
-            )  # Default reason if stop was requested
-
-            if event == "call":
-                if self.state_manager.step_into:
-                    stop_now = True
-                    reason_for_stop = f"Step into {frm.f_code.co_name}"
-                elif self.state_manager.step_over or self.state_manager.step_out:
-                    stop_now = False  # Don't stop at call
-                elif stop_now:
-                    pass  # Initial entry, stop at call
-            elif event == "line":
-                if self.state_manager.run_until_line_info:
-                    r_file, r_ln = self.state_manager.run_until_line_info
-                    if current_file_abs == r_file and frm.f_lineno == r_ln:
-                        stop_now = True
-                        reason_for_stop = "Until"
-                        self.state_manager.run_until_line_info = None
-                elif self.state_manager.step_into:
-                    stop_now = True
-                    reason_for_stop = "Step"
-                elif (
-                    self.state_manager.step_over
-                    and current_depth <= self.state_manager.step_over_target_depth
-                ):
-                    stop_now = True
-                    reason_for_stop = "Next"
-                elif (
-                    self.state_manager.step_out
-                    and current_depth <= self.state_manager.step_out_target_depth
-                ):
-                    stop_now = True
-                    reason_for_stop = "Finish"
-                elif stop_now and reason_for_stop == "Initial entry":
-                    reason_for_stop = "First line"  # Refine reason
-            elif event == "exception":
-                stop_now = True
-                reason_for_stop = "Exception"
-
-            if not stop_now:  # Check breakpoints if not already stopping
-                bp_info = self.breakpoint_manager.check_breakpoint(
-                    current_file_abs, frm.f_lineno, frm.f_globals, frm.f_locals
-                )
-                if bp_info:
-                    stop_now = True
-                    reason_for_stop = f"BP {self._get_bp_id(bp_info)}"
-
-            if stop_now:
-                self._capture_full_stack(self.execution_frame)
-                self.interaction_frame = self.execution_frame
-                self._interaction_stack_idx = 0
-                self.update_prompt()
-                self.print_current_location(self.interaction_frame, reason_for_stop)
-                self._print_watched_expressions()
-                if event == "exception":
-                    exc_type, exc_val, exc_tb = arg
-                    print(f"{_TermColors.FAIL}Exception:{_TermColors.ENDC}")
-                    print_exception(
-                        exc_type, exc_val, exc_tb, None, stdout
-                    )
-
-                # Reset stepping flags *after* they caused a stop and before cmdloop (which might set new ones)
-                # The request_stop_at_next_suitable_event is already False, so commands like 'c' work.
-                # Stepping commands will set request_stop_at_next_suitable_event = True again.
-                if (
-                    self.state_manager.step_into
-                    or self.state_manager.step_over
-                    or self.state_manager.step_out
-                ):
-                    self.state_manager.reset_stepping_flags()
-
-                self.cmdloop()
-                if self.quit_debugger:
-                    settrace(None)
-                    return None
-
-            return self.trace_dispatch
-
-        def _get_bp_id(self, bp_info_obj):
-            for id, info in self.breakpoint_manager.breakpoints_by_id.items():
-                if info == bp_info_obj:
-                    return id
-            return "?"
-
-        def precmd(self, line):
-            line = line.strip()
-            if line:
-                self.command_history.append(line)
-                self.last_non_empty_cmd = line
-            if not line:
-                return ""
-            parts = line.split(maxsplit=1)
-            cmd_name = parts[0]
-            if cmd_name in self.aliases:
-                return (
-                    f"{self.aliases[cmd_name]} {parts[1]}"
-                    if len(parts) > 1
-                    else self.aliases[cmd_name]
+            self._stack_idx_by_frame = {
+                id(f): i for i, f in enumerate(self._stack_cache)
+            }
+        return self._stack_cache
+
+    def update_prompt(self):
+        frm = self.interaction_frame
+        ind = ""
+        if frm:
+            if self.interaction_frame != self.execution_frame:
+                ind = f" (inspecting frame {self._interaction_stack_idx})"
+            self.prompt = f"({_BL}pydbg{_E} {_GY}{path.basename(frm.f_code.co_filename)}:{frm.f_lineno} {frm.f_code.co_name}(){ind}{_E}) "
+        else:
+            self.prompt = self.prompt_template
+
+    def print_current_location(self, frm, reason=""):
+        if not frm:
+            return
+        fn, ln, nm = frm.f_code.co_filename, frm.f_lineno, frm.f_code.co_name
+        if reason:
+            print(f"{_GY}{reason} at:{_E}")
+        if frm is self._stack_top:
+            idx = 0
+        elif self._full_stack_at_stop:
+            idx = self._stack_idx_by_frame.get(id(frm), "?")
+        else:
+            idx = "?"
+        print(f" Frame {idx}: {_B}{path.basename(fn)}:{ln} {nm}(){_E}")
+        ctx = 5
+        sline = max(1, ln - (ctx // 2))
+        eline = sline + ctx - 1
+        for i, txt in enumerate(getlines(fn)[sline - 1 : eline], start=sline):
+            txt = txt.rstrip("\n")
+            if txt:
+                pfx = (
+                    self.current_line_marker
+                    if i == ln and frm == self.execution_frame
+                    else "     "
                 )
-            return line
-
-        def default(self, line):
-            if self.interaction_frame:
+                print(f" {pfx}{i:4d} {_CY if i==ln else ''}{txt}{_E if i==ln else ''}")
+        print()
+
+    def _frame_locals(self, frm):
+        """Returns frm.f_locals, materialized at most once per stop."""
+        f_locals = self._locals_cache.get(frm)
+        if f_locals is None:
+            f_locals = self._locals_cache[frm] = frm.f_locals
+        return f_locals
+
+    def _print_watched_expressions(self):
+        if self.watched_expressions and self.interaction_frame:
+            print(f"{_H}Watched Expressions (frame {self._interaction_stack_idx}):{_E}")
+            for i, (ex, code) in enumerate(self.watched_expressions.items()):
                 try:
-                    print(
-                        repr(
-                            eval(
-                                line,
-                                self.interaction_frame.f_globals,
-                                self.interaction_frame.f_locals.copy(),
-                            )
-                        )
+                    v = eval(
+                        code,
+                        self.interaction_frame.f_globals,
+                        self._frame_locals(self.interaction_frame),
                     )
+                    print(f"  {i}: {ex} = {repr(v)}")
                 except Exception as e:
-                    print(f"{_TermColors.FAIL}Error: '{line}' ({e}){_TermColors.ENDC}")
-            else:
-                print(f"{_TermColors.FAIL}No active frame.{_TermColors.ENDC}")
+                    print(f"  {i}: {ex} = Error: {e}")
+            print()
 
-        def emptyline(self):
-            if self.last_non_empty_cmd:
-                print(
-                    f"({_TermColors.GREY}Repeating: {self.last_non_empty_cmd}{_TermColors.ENDC})"
-                )
-                self.onecmd(self.last_non_empty_cmd)
-
-        def do_help(self, arg):
-            """List available commands with "help" or detailed help with "help cmd"."""
-            if arg:
-                orig_arg, act_cmd, is_alias = arg, arg, False
-                if arg in self.aliases:
-                    act_cmd = self.aliases[arg]
-                    is_alias = True
-                try:
-                    doc = getattr(self, "do_" + act_cmd).__doc__
-                    if doc:
-                        print(
-                            (
-                                f"'{orig_arg}' is alias for '{act_cmd}'.\n"
-                                if is_alias
-                                else ""
-                            )
-                            + doc.strip()
-                        )
-                    else:
-                        print(
-                            f"No help for '{act_cmd}'.{(f"\n'{orig_arg}' is alias for '{act_cmd}'." if is_alias else "")}"
-                        )
-                except AttributeError:
-                    print(f"No help for '{orig_arg}'. Unknown.")
-            else:
-                super().do_help(arg)
-                print(f"\n{_TermColors.BOLD}Aliases:{_TermColors.ENDC}")
-                max_len = (
-                    max(len(a) for a in self.aliases.keys()) if self.aliases else 0
-                )
-                for a, c in sorted(self.aliases.items()):
-                    print(f"  {a:<{max_len+2}} -> {c}")
-                print(
-                    f"\n{_TermColors.GREY}Use 'help <alias>' for specific command help.{_TermColors.ENDC}"
-                )
+    def trace_dispatch(self, frm, event, arg):
+        # do_quit already removed every event source, so no event arrives after it.
+        assert not self.quit_debugger
+        if not self._armed and event != "exception":
+            return self.trace_dispatch
 
-        def do_next(self, arg):
-            """n: Step to next line (step over calls)."""
-            self.state_manager.configure_for_step_over(
-                self._get_frame_depth(self.execution_frame)
+        stop_requested = self.state_manager.request_stop_at_next_suitable_event
+        self.state_manager.request_stop_at_next_suitable_event = (
+            False  # Assume continue, cmds will set True if needed
+        )
+        reason_for_stop = self._event_dispatch.get(event, self._on_other_event)(
+            frm, stop_requested
+        )
+
+        if not reason_for_stop:  # Check breakpoints if not already stopping
+            bp_info = self.breakpoint_manager.check_breakpoint(frm)
+            if not bp_info:
+                return self.trace_dispatch
+            reason_for_stop = f"BP {bp_info.id}"
+
+        self.execution_frame = frm
+        self._capture_full_stack(frm)
+        self.update_prompt()
+        self.print_current_location(self.interaction_frame, reason_for_stop)
+        self._print_watched_expressions()
+        if event == "exception":
+            exc_type, exc_val, exc_tb = arg
+            print(f"{_R}Exception:{_E}")
+            print_exception(
+                exc_type, exc_val, exc_tb, None, stdout
             )
-            return True
 
-        def do_step(self, arg):
-            """s: Step into call or to next line."""
-            self.state_manager.configure_for_step_into()
-            return True
+        # Reset stepping flags *after* they caused a stop and before cmdloop (which might set new ones)
+        # The request_stop_at_next_suitable_event is already False, so commands like 'c' work.
+        # Stepping commands will set request_stop_at_next_suitable_event = True again.
+        if (
+            self.state_manager.step_into
+            or self.state_manager.step_over
+            or self.state_manager.step_out
+        ):
+            self.state_manager.reset_stepping_flags()
 
-        def do_continue(self, arg):
-            """c: Continue execution."""
-            self.state_manager.configure_for_run()
-            print(
-                f"{_TermColors.OKGREEN}Continuing...{_TermColors.ENDC}"
-                if self.execution_frame
-                else ""
+        # The prompt runs inline on the traced thread: neither settrace nor sys.monitoring
+        # delivers events from inside their own callback, so commands are never traced.
+        self.cmdloop()
+        self._locals_cache.clear()
+        if self.quit_debugger:
+            return None
+        self._refresh_dispatch()
+        if self._monitoring:
+            self._sync_monitoring()
+        else:
+            frm.f_trace_lines = self._armed
+        # Drop this stop's frame references, so frames finishing while we run free their locals.
+        self.execution_frame = self.interaction_frame = None
+        self._stack_top = self._stack_cache = self._depth_frame = None
+        return self.trace_dispatch
+
+    # Event handlers return the reason to stop, or None to fall through to breakpoints.
+    def _on_call_event(self, frm, stop_requested):
+        if self.state_manager.step_into:
+            return f"Step into {frm.f_code.co_name}"
+        if self.state_manager.step_over or self.state_manager.step_out:
+            return None  # Don't stop at call
+        return "Initial entry" if stop_requested else None
+
+    def _on_exception_event(self, frm, stop_requested):
+        return "Exception"
+
+    def _on_other_event(self, frm, stop_requested):
+        return "Initial entry" if stop_requested else None
+
+    def _line_handler_default(self, frm, stop_requested):
+        return "First line" if stop_requested else None
+
+    def _line_handler_until(self, frm, stop_requested):
+        r_file, r_ln = self.state_manager.run_until_line_info
+        if frm.f_lineno == r_ln and (
+            self.breakpoint_manager.abs_path(frm.f_code.co_filename) == r_file
+        ):
+            self.state_manager.run_until_line_info = None
+            return "Until"
+        return "Initial entry" if stop_requested else None
+
+    def _line_handler_step(self, frm, stop_requested):
+        return "Step"
+
+    def _line_handler_next(self, frm, stop_requested):
+        if self._get_frame_depth(frm) <= self.state_manager.step_over_target_depth:
+            return "Next"
+        return "First line" if stop_requested else None
+
+    def _line_handler_finish(self, frm, stop_requested):
+        if self._get_frame_depth(frm) <= self.state_manager.step_out_target_depth:
+            return "Finish"
+        return "First line" if stop_requested else None
+
+    def _is_library_code(self, code):
+        """True for code under skip_prefixes, cached per file name; the entry code never is."""
+        if code is self._entry_code:
+            return False
+        filename = code.co_filename
+        is_library = self._library_files.get(filename)
+        if is_library is None:
+            is_library = filename.startswith(self.skip_prefixes)
+            self._library_files[filename] = is_library
+        return is_library
+
+    def _traces_callee(self, code):
+        """True if code, other than the entry code, must be traced: it holds a breakpoint."""
+        if self._is_library_code(code):
+            return False
+        return self.breakpoint_manager.code_has_breakpoints(code)
+
+    def _refresh_dispatch(self):
+        """Re-selects the line handler and the armed flag for the state chosen at the prompt."""
+        sm = self.state_manager
+        if sm.run_until_line_info:
+            line_handler = self._line_handler_until
+        elif sm.step_into:
+            line_handler = self._line_handler_step
+        elif sm.step_over:
+            line_handler = self._line_handler_next
+        elif sm.step_out:
+            line_handler = self._line_handler_finish
+        else:
+            line_handler = self._line_handler_default
+        self._event_dispatch["line"] = line_handler
+        self._armed = bool(
+            self.breakpoint_manager.breakpoints_by_file
+            or sm.request_stop_at_next_suitable_event
+            or line_handler != self._line_handler_default
+        )
+
+    def start_monitoring(self, entry_code):
+        """Feeds sys.monitoring (PEP 669) events into trace_dispatch instead of settrace."""
+        E = _MON_EVENTS
+        for event, callback in (
+            (E.PY_START, self._on_py_start),
+            (E.LINE, self._on_line),
+            (E.JUMP, self._on_jump),
+            (E.PY_RETURN, self._on_py_return),
+            (E.RAISE, self._on_raise),
+        ):
+            monitoring.register_callback(_MON_TOOL_ID, event, callback)
+        self._monitoring = True
+        self._entry_code = entry_code
+        self._sync_monitoring()
+
+    def stop_monitoring(self):
+        """Removes every event this debugger enabled and releases the tool id."""
+        if not self._monitoring:
+            return
+        self._monitoring = False
+        E = _MON_EVENTS
+        for code in self._instrumented | {self._entry_code}:
+            monitoring.set_local_events(_MON_TOOL_ID, code, E.NO_EVENTS)
+        self._instrumented = set()
+        monitoring.set_events(_MON_TOOL_ID, E.NO_EVENTS)
+        for event in (E.PY_START, E.LINE, E.JUMP, E.PY_RETURN, E.RAISE):
+            monitoring.register_callback(_MON_TOOL_ID, event, None)
+        monitoring.free_tool_id(_MON_TOOL_ID)
+
+    def _sync_monitoring(self):
+        """Enables line events only on code objects the resumed state can stop in."""
+        E = _MON_EVENTS
+        line_codes = {
+            code
+            for code in self._instrumented | {self._entry_code}
+            if self.breakpoint_manager.code_has_breakpoints(code)
+        }
+        if (
+            self.state_manager.request_stop_at_next_suitable_event
+            and self.execution_frame
+        ):
+            line_codes.add(self.execution_frame.f_code)
+            # A pending step may return into a caller; settrace keeps tracing every traced
+            # caller up to the entry frame, so those need line events too.
+            frm = self.execution_frame
+            while frm.f_code is not self._entry_code and frm.f_back:
+                frm = frm.f_back
+                if frm.f_code is self._entry_code or self._traces_callee(frm.f_code):
+                    line_codes.add(frm.f_code)
+        for code in self._instrumented | line_codes | {self._entry_code}:
+            events = _MON_TRACED if code in line_codes else E.NO_EVENTS
+            if code is self._entry_code:
+                events |= E.PY_START | E.PY_RETURN
+            monitoring.set_local_events(_MON_TOOL_ID, code, events)
+        self._instrumented = line_codes
+        if self.breakpoint_manager.breakpoints_by_file:
+            # Global PY_START lets _on_py_start find code objects holding breakpoints.
+            monitoring.set_events(_MON_TOOL_ID, E.RAISE | E.PY_START)
+        else:
+            monitoring.set_events(_MON_TOOL_ID, E.RAISE)
+        bp_changed = self.breakpoint_manager.change_count != self._synced_bp_changes
+        self._synced_bp_changes = self.breakpoint_manager.change_count
+        stepping = self.state_manager.request_stop_at_next_suitable_event or (
+            self._event_dispatch["line"] != self._line_handler_default
+        )
+        if (self._lines_disabled and (bp_changed or stepping)) or (
+            self._starts_disabled and bp_changed
+        ):
+            self._lines_disabled = self._starts_disabled = False
+            monitoring.restart_events()
+
+    def _on_py_start(self, code, instruction_offset):
+        if code is self._entry_code:
+            self.trace_dispatch(_getframe(1), "call", None)
+        elif self._traces_callee(code):
+            self._instrumented.add(code)
+            monitoring.set_local_events(_MON_TOOL_ID, code, _MON_TRACED)
+        elif code not in self._instrumented:
+            self._starts_disabled = True
+            return monitoring.DISABLE
+
+    def _on_line(self, code, line_number):
+        return self._dispatch_line(_getframe(1), code, line_number)
+
+    def _dispatch_line(self, frame, code, line_number):
+        self.trace_dispatch(frame, "line", None)
+        if (
+            self._monitoring
+            and self._event_dispatch["line"] == self._line_handler_default
+            and not self.state_manager.request_stop_at_next_suitable_event
+            and line_number not in self.breakpoint_manager.breakpoints_for_code(code)
+        ):
+            # Nothing can stop here until the next prompt; silence this line until then.
+            self._lines_disabled = True
+            return monitoring.DISABLE
+
+    def _on_jump(self, code, instruction_offset, destination_offset):
+        # settrace reports a backward jump within one line (a one-line loop or
+        # comprehension) as a new line event; LINE does not fire for it.
+        if destination_offset > instruction_offset:
+            return monitoring.DISABLE
+        line_number = _offset_line(code, destination_offset)
+        if line_number != _offset_line(code, instruction_offset):
+            return monitoring.DISABLE  # The LINE event at the target covers it
+        return self._dispatch_line(_getframe(1), code, line_number)
+
+    def _on_py_return(self, code, instruction_offset, retval):
+        self.trace_dispatch(_getframe(1), "return", retval)
+
+    def _on_raise(self, code, instruction_offset, exception):
+        if code is self._entry_code or code in self._instrumented:
+            self.trace_dispatch(
+                _getframe(1),
+                "exception",
+                (type(exception), exception, exception.__traceback__),
             )
-            return True
-
-        def do_quit(self, arg):
-            """q: Quit debugger."""
-            print(f"{_TermColors.WARNING}Quitting.{_TermColors.ENDC}")
-            self.quit_debugger = True
-            settrace(None)
-            return True
 
-        def do_EOF(self, arg):
-            """Handles Ctrl-D as quit."""
-            return self.do_quit(arg)
-
-        def do_backtrace(self, arg):
-            """bt: Print call stack. '*' exec frame, '->' inspect frame."""
-            if not self._full_stack_at_stop:
-                self._capture_full_stack(self.execution_frame or self.interaction_frame)
-            if not self._full_stack_at_stop:
-                print("No stack.")
-                return
-            print(
-                f"{_TermColors.HEADER}Call Stack (most recent first - index 0):{_TermColors.ENDC}"
+    def precmd(self, line):
+        line = line.strip()
+        if line:
+            self.command_history.append(line)
+            self.last_non_empty_cmd = line
+        if not line:
+            return ""
+        parts = line.split(maxsplit=1)
+        cmd_name = parts[0]
+        if cmd_name in self.aliases:
+            return (
+                f"{self.aliases[cmd_name]} {parts[1]}"
+                if len(parts) > 1
+                else self.aliases[cmd_name]
             )
-            for idx, frm in enumerate(self._full_stack_at_stop):
-                pfx = "->" if frm == self.interaction_frame else "  "
-                exm = "*" if frm == self.execution_frame else " "
-                print(
-                    f"{pfx}{exm}#{idx}: {_TermColors.OKCYAN}{frm.f_code.co_name}(){_TermColors.ENDC} at {_TermColors.GREY}{path.basename(frm.f_code.co_filename)}:{frm.f_lineno}{_TermColors.ENDC}"
-                )
-            print()
+        return line
 
-        def do_printvar(self, arg):
-            """p <expr>: Evaluate and print expression in current interaction frame."""
-            if not arg:
-                print("Arg required.")
-                return
-            if not self.interaction_frame:
-                print("No frame.")
-                return
+    def postcmd(self, stop, line):
+        # break/clear only mark the table stale; a queued batch of them renders it once.
+        if self._bp_dirty and not self.cmdqueue and not self.quit_debugger:
+            self._bp_dirty = False
+            self.breakpoint_manager.list_breakpoints()
+        return stop
+
+    def default(self, line):
+        if self.interaction_frame:
             try:
                 print(
-                    f"{arg} = {repr(eval(arg, self.interaction_frame.f_globals, self.interaction_frame.f_locals))}"
+                    repr(
+                        eval(
+                            line,
+                            self.interaction_frame.f_globals,
+                            self._frame_locals(self.interaction_frame),
+                        )
+                    )
                 )
             except Exception as e:
-                print(f"{_TermColors.FAIL}Error: {e}{_TermColors.ENDC}")
-
-        def do_setvar(self, arg):
-            """set <var> = <expr>: Set local variable in current interaction frame."""
-            if not self.interaction_frame:
-                print("No frame.")
-                return
-            m = match(r"^\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*(.*)$", arg)
-            if not m:
-                print("Usage: set <var> = <expr>")
-                return
-            var, expr = m.groups()
+                print(f"{_R}Error: '{line}' ({e}){_E}")
+        else:
+            print(f"{_R}No active frame.{_E}")
+
+    def emptyline(self):
+        if self.last_non_empty_cmd:
+            print(f"({_GY}Repeating: {self.last_non_empty_cmd}{_E})")
+            self.onecmd(self.last_non_empty_cmd)
+
+    def do_help(self, arg):
+        """List available commands with "help" or detailed help with "help cmd"."""
+        if arg:
+            orig_arg, act_cmd, is_alias = arg, arg, False
+            if arg in self.aliases:
+                act_cmd = self.aliases[arg]
+                is_alias = True
             try:
-                val = eval(
-                    expr,
-                    self.interaction_frame.f_globals,
-                    self.interaction_frame.f_locals,
-                )
-                self.interaction_frame.f_locals[var] = val
-                print(f"Set {var}={repr(val)}")
-            except Exception as e:
-                print(f"{_TermColors.FAIL}Error: {e}{_TermColors.ENDC}")
-
-        def do_break(self, arg):
-            """b [<file>:]<line|func> [if <cond>]: Set breakpoint."""
-            if not arg:
-                print("Location required.")
-                return
-            parts = arg.split(" if ", 1)
-            loc = parts[0]
-            cond = parts[1] if len(parts) > 1 else None
-            ctx_file = (
-                self.interaction_frame.f_code.co_filename
-                if self.interaction_frame
-                else __file__
+                doc = getattr(self, "do_" + act_cmd).__doc__
+                if doc:
+                    print(
+                        (
+                            f"'{orig_arg}' is alias for '{act_cmd}'.\n"
+                            if is_alias
+                            else ""
+                        )
+                        + doc.strip()
+                    )
+                else:
+                    print(
+                        f"No help for '{act_cmd}'.{(f"\n'{orig_arg}' is alias for '{act_cmd}'." if is_alias else "")}"
+                    )
+            except AttributeError:
+                print(f"No help for '{orig_arg}'. Unknown.")
+        else:
+            super().do_help(arg)
+            print(f"\n{_B}Aliases:{_E}")
+            max_len = (
+                max(len(a) for a in self.aliases.keys()) if self.aliases else 0
             )
-            file_abs, line_no = self.breakpoint_manager.parse_location_string(
-                loc, ctx_file
+            for a, c in sorted(self.aliases.items()):
+                print(f"  {a:<{max_len+2}} -> {c}")
+            print(f"\n{_GY}Use 'help <alias>' for specific command help.{_E}")
+
+    def do_next(self, arg):
+        """n: Step to next line (step over calls)."""
+        self.state_manager.configure_for_step_over(
+            self._get_frame_depth(self.execution_frame)
+        )
+        return True
+
+    def do_step(self, arg):
+        """s: Step into call or to next line."""
+        self.state_manager.configure_for_step_into()
+        return True
+
+    def do_continue(self, arg):
+        """c: Continue execution."""
+        self.state_manager.configure_for_run()
+        print(
+            f"{_G}Continuing...{_E}"
+            if self.execution_frame
+            else ""
+        )
+        return True
+
+    def do_quit(self, arg):
+        """q: Quit debugger."""
+        print(f"{_Y}Quitting.{_E}")
+        self.quit_debugger = True
+        settrace(None)
+        self.stop_monitoring()
+        return True
+
+    def do_EOF(self, arg):
+        """Handles Ctrl-D as quit."""
+        return self.do_quit(arg)
+
+    def do_backtrace(self, arg):
+        """bt: Print call stack. '*' exec frame, '->' inspect frame."""
+        if not self._full_stack_at_stop:
+            self._capture_full_stack(self.execution_frame or self.interaction_frame)
+        if not self._full_stack_at_stop:
+            print("No stack.")
+            return
+        print(f"{_H}Call Stack (most recent first - index 0):{_E}")
+        for idx, frm in enumerate(self._full_stack_at_stop):
+            pfx = "->" if frm == self.interaction_frame else "  "
+            exm = "*" if frm == self.execution_frame else " "
+            print(
+                f"{pfx}{exm}#{idx}: {_CY}{frm.f_code.co_name}(){_E} at {_GY}{path.basename(frm.f_code.co_filename)}:{frm.f_lineno}{_E}"
             )
-            if file_abs and line_no:
-                self.breakpoint_manager.add_breakpoint(file_abs, line_no, cond)
-            self.do_info("breakpoints")
-
-        def do_clear(self, arg):
-            """cl <id|loc|all>: Clear breakpoint(s)."""
-            if not arg:
-                print("Arg required.")
-                return
-            if arg.lower() == "all":
-                self.breakpoint_manager.clear_all_breakpoints()
-                return
-            try:
-                self.breakpoint_manager.clear_breakpoint(int(arg), None)
-            except ValueError:
-                self.breakpoint_manager.clear_breakpoint(
-                    arg,
-                    (
-                        self.interaction_frame.f_code.co_filename
-                        if self.interaction_frame
-                        else __file__
-                    ),
-                )
-            self.do_info("breakpoints")
-
-        def do_ignore_breakpoint(self, arg):
-            """ignore <bp_id> <count>: Set ignore count for breakpoint."""
-            p = arg.split()
-            if len(p) != 2:
-                print("Usage: ignore <id> <count>")
-                return
-            try:
-                self.breakpoint_manager.set_ignore_count(int(p[0]), int(p[1]))
-            except ValueError:
-                print("Invalid id or count.")
-
-        def do_list(self, arg):
-            """l: List source around current interaction frame line."""
-            if not self.interaction_frame:
-                print("No frame.")
-                return
-            self.print_current_location(
-                self.interaction_frame, f"Listing frame {self._interaction_stack_idx}"
+        print()
+
+    def do_printvar(self, arg):
+        """p <expr>: Evaluate and print expression in current interaction frame."""
+        if not arg:
+            print("Arg required.")
+            return
+        if not self.interaction_frame:
+            print("No frame.")
+            return
+        try:
+            print(
+                f"{arg} = {repr(eval(arg, self.interaction_frame.f_globals, self._frame_locals(self.interaction_frame)))}"
             )
-
-        def do_rununtil(self, arg):
-            """until <line>: Continue until line in current exec frame's file."""
-            if not arg:
-                print("Line # required.")
-                return
-            if not self.execution_frame:
-                print("No exec frame.")
-                return
+        except Exception as e:
+            print(f"{_R}Error: {e}{_E}")
+
+    def do_setvar(self, arg):
+        """set <var> = <expr>: Set local variable in current interaction frame."""
+        if not self.interaction_frame:
+            print("No frame.")
+            return
+        m = _SETVAR_RE.match(arg)
+        if not m:
+            print("Usage: set <var> = <expr>")
+            return
+        var, expr = m.groups()
+        try:
+            val = eval(
+                expr,
+                self.interaction_frame.f_globals,
+                self._frame_locals(self.interaction_frame),
+            )
+            self._frame_locals(self.interaction_frame)[var] = val
+            _write_back_locals(self.interaction_frame)
+            print(f"Set {var}={repr(val)}")
+        except Exception as e:
+            print(f"{_R}Error: {e}{_E}")
+
+    def do_break(self, arg):
+        """b [<file>:]<line|func> [if <cond>]: Set breakpoint."""
+        if not arg:
+            print("Location required.")
+            return
+        parts = arg.split(" if ", 1)
+        loc = parts[0]
+        cond = parts[1] if len(parts) > 1 else None
+        ctx_file = (
+            self.interaction_frame.f_code.co_filename
+            if self.interaction_frame
+            else __file__
+        )
+        file_abs, line_no = self.breakpoint_manager.parse_location_string(
+            loc, ctx_file
+        )
+        if file_abs and line_no:
             try:
-                ln = int(arg)
-                file_abs = path.abspath(self.execution_frame.f_code.co_filename)
-                self.state_manager.configure_for_run_until(file_abs, ln)
-                print(
-                    f"{_TermColors.OKGREEN}Running until {ln} in {path.basename(file_abs)}...{_TermColors.ENDC}"
-                )
-                return True
-            except ValueError:
-                print(f"{_TermColors.FAIL}Invalid line #: {arg}{_TermColors.ENDC}")
-
-        def do_finish(self, arg):
-            """fin: Execute until current exec function returns."""
-            if not self.execution_frame or not self.execution_frame.f_back:
-                print("Cannot 'finish'.")
-                return False
-            self.state_manager.configure_for_step_out(
-                self._get_frame_depth(self.execution_frame.f_back)
+                self.breakpoint_manager.add_breakpoint(file_abs, line_no, cond)
+            except _COMPILE_ERRORS as e:
+                print(f"{_R}Invalid BP condition '{cond}': {e}{_E}")
+        self._bp_dirty = True
+
+    def do_clear(self, arg):
+        """cl <id|loc|all>: Clear breakpoint(s)."""
+        if not arg:
+            print("Arg required.")
+            return
+        if arg.lower() == "all":
+            self.breakpoint_manager.clear_all_breakpoints()
+            return
+        try:
+            self.breakpoint_manager.clear_breakpoint(int(arg), None)
+        except ValueError:
+            self.breakpoint_manager.clear_breakpoint(
+                arg,
+                (
+                    self.interaction_frame.f_code.co_filename
+                    if self.interaction_frame
+                    else __file__
+                ),
             )
-            print(
-                f"{_TermColors.OKGREEN}Finishing {self.execution_frame.f_code.co_name}...{_TermColors.ENDC}"
+        self._bp_dirty = True
+
+    def do_ignore_breakpoint(self, arg):
+        """ignore <bp_id> <count>: Set ignore count for breakpoint."""
+        p = arg.split()
+        if len(p) != 2:
+            print("Usage: ignore <id> <count>")
+            return
+        try:
+            self.breakpoint_manager.set_ignore_count(int(p[0]), int(p[1]))
+        except ValueError:
+            print("Invalid id or count.")
+
+    def do_list(self, arg):
+        """l: List source around current interaction frame line."""
+        if not self.interaction_frame:
+            print("No frame.")
+            return
+        self.print_current_location(
+            self.interaction_frame, f"Listing frame {self._interaction_stack_idx}"
+        )
+
+    def do_rununtil(self, arg):
+        """until <line>: Continue until line in current exec frame's file."""
+        if not arg:
+            print("Line # required.")
+            return
+        if not self.execution_frame:
+            print("No exec frame.")
+            return
+        try:
+            ln = int(arg)
+            file_abs = self.breakpoint_manager.abs_path(
+                self.execution_frame.f_code.co_filename
             )
+            self.state_manager.configure_for_run_until(file_abs, ln)
+            print(f"{_G}Running until {ln} in {path.basename(file_abs)}...{_E}")
             return True
+        except ValueError:
+            print(f"{_R}Invalid line #: {arg}{_E}")
 
-        def do_info(self, arg):
-            """info <subtopic>: Display info (locals,globals,breakpoints,stack,heap,frame,history,watch)."""
-            if not arg:
-                print("Subtopic required.")
-                return
-            frm = self.interaction_frame
-            if not frm and arg not in ["breakpoints", "heap", "history", "watch"]:
-                print("No frame.")
-                return
-            if arg == "locals":
-                if frm:
-                    print(
-                        f"{_TermColors.HEADER}Locals (frame {self._interaction_stack_idx}):{_TermColors.ENDC}"
-                    )
-                    (
-                        [print(f"  {n}:{repr(v)}") for n, v in frm.f_locals.items()]
-                        if frm.f_locals
-                        else print("  No locals.")
-                    )
-            elif arg == "globals":
-                if frm:
-                    print(
-                        f"{_TermColors.HEADER}Globals (frame {self._interaction_stack_idx},excerpt):{_TermColors.ENDC}"
-                    )
-                    c = 0
-                    [
-                        [print(f"  {n}:{repr(v)}"), c := c + 1]
-                        for n, v in frm.f_globals.items()
-                        if not (n.startswith("__") and n.endswith("__")) and c < 25
-                    ] or (c > 25 and print("  ..."))
-            elif arg == "breakpoints":
-                self.breakpoint_manager.list_breakpoints()
-            elif arg == "stack":
-                self.do_backtrace("")
-            elif arg == "heap":
-                print(f"{_TermColors.HEADER}Heap Summary:{_TermColors.ENDC}")
-                import gc
-
-                gc.collect()
-                o = gc.get_objects()
-                t = Counter(type(obj).__name__ for obj in o)
-                print("  Top 20:")
-                [print(f"    {ty:<30}:{ct}") for ty, ct in t.most_common(20)]
-                print(f"  Total: {len(o)}")
-            elif arg == "frame":
-                if frm:
-                    print(
-                        f"{_TermColors.HEADER}Frame Info (idx {self._interaction_stack_idx}):{_TermColors.ENDC}"
-                    )
-                    print(
-                        f"  Func:{frm.f_code.co_name}\n  File:{frm.f_code.co_filename}\n  Line:{frm.f_lineno}\n  Byte:{frm.f_lasti}"
-                    )
-                    print(
-                        f"{_TermColors.WARNING}Not exec frame.{_TermColors.ENDC}"
-                        if frm != self.execution_frame
-                        else ""
-                    )
-            elif arg == "history":
-                print(f"{_TermColors.HEADER}History:{_TermColors.ENDC}")
-                (
-                    [
-                        print(
-                            f"  {len(self.command_history)-min(20,len(self.command_history))+i :3}:{item}"
-                        )
-                        for i, item in enumerate(list(self.command_history)[-20:])
-                    ]
-                    if self.command_history
-                    else print("  No history.")
-                )
-            elif arg == "watch":
-                (
-                    self._print_watched_expressions()
-                    if self.watched_expressions
-                    else print("  No watched expressions.")
-                )
-            else:
-                print(f"Unknown info: {arg}.")
-
-        def do_up_stack(self, arg_str):
-            """up [N]: Move N levels up call stack (older frame, higher index)."""
-            if not self._full_stack_at_stop:
-                print("No stack.")
+    def do_finish(self, arg):
+        """fin: Execute until current exec function returns."""
+        if not self.execution_frame or not self.execution_frame.f_back:
+            print("Cannot 'finish'.")
+            return False
+        self.state_manager.configure_for_step_out(
+            self._get_frame_depth(self.execution_frame.f_back)
+        )
+        print(f"{_G}Finishing {self.execution_frame.f_code.co_name}...{_E}")
+        return True
+
+    def do_info(self, arg):
+        """info <subtopic>: Display info (locals,globals,breakpoints,stack,heap [full],frame,history,watch)."""
+        if not arg:
+            print("Subtopic required.")
+            return
+        frm = self.interaction_frame
+        if not frm and arg not in [
+            "breakpoints",
+            "heap",
+            "heap full",
+            "history",
+            "watch",
+        ]:
+            print("No frame.")
+            return
+        handler = self._info_handlers.get(arg)
+        if handler:
+            handler(frm)
+        else:
+            print(f"Unknown info: {arg}.")
+
+    # 'info' subtopic handlers, dispatched through _info_handlers.
+    def _info_locals(self, frm):
+        buf = [f"{_H}Locals (frame {self._interaction_stack_idx}):{_E}\n"]
+        f_locals = self._frame_locals(frm)
+        if not f_locals:
+            buf.append("  No locals.\n")
+        buf.extend(f"  {n}:{_SR(v)}\n" for n, v in f_locals.items())
+        print("".join(buf), end="")
+
+    def _info_globals(self, frm):
+        buf = [f"{_H}Globals (frame {self._interaction_stack_idx},excerpt):{_E}\n"]
+        c = 0
+        for n, v in frm.f_globals.items():
+            if n.startswith("__") and n.endswith("__"):
+                continue
+            if c == 25:
+                buf.append("  ...\n")
+                break
+            buf.append(f"  {n}:{_SR(v)}\n")
+            c += 1
+        print("".join(buf), end="")
+
+    def _info_breakpoints(self, frm):
+        self.breakpoint_manager.list_breakpoints()
+
+    def _info_stack(self, frm):
+        self.do_backtrace("")
+
+    def _info_heap(self, frm):
+        print(f"{_H}Heap Summary:{_E}")
+        import gc
+
+        print(f"  Allocated blocks: {getallocatedblocks()}")
+        for g, st in enumerate(gc.get_stats()):
+            print(
+                f"  Gen {g}: collections={st['collections']} collected={st['collected']} uncollectable={st['uncollectable']}"
+            )
+        print(f"{_GY}  Use 'info heap full' for a type histogram.{_E}")
+
+    def _info_heap_full(self, frm):
+        print(f"{_H}Heap Types (sampled):{_E}")
+        import gc
+        from collections import Counter
+
+        gc.collect()
+        t = Counter(
+            type(obj).__name__
+            for obj in islice(gc.get_objects(generation=2), _HEAP_SAMPLE_SIZE)
+        )
+        buf = ["  Top 20:\n"]
+        buf.extend(f"    {ty:<30}:{ct}\n" for ty, ct in t.most_common(20))
+        buf.append(f"  Sampled: {t.total()} of the oldest generation\n")
+        print("".join(buf), end="")
+
+    def _info_frame(self, frm):
+        print(f"{_H}Frame Info (idx {self._interaction_stack_idx}):{_E}")
+        print(
+            f"  Func:{frm.f_code.co_name}\n  File:{frm.f_code.co_filename}\n  Line:{frm.f_lineno}\n  Byte:{frm.f_lasti}"
+        )
+        print(f"{_Y}Not exec frame.{_E}" if frm != self.execution_frame else "")
+
+    def _info_history(self, frm):
+        buf = [f"{_H}History:{_E}\n"]
+        stored = len(self.command_history)
+        recent = list(islice(self.command_history, max(0, stored - 20), stored))
+        if not recent:
+            buf.append("  No history.\n")
+        for i, item in enumerate(recent, stored - len(recent)):
+            buf.append(f"  {i :3}:{item}\n")
+        print("".join(buf), end="")
+
+    def _info_watch(self, frm):
+        (
+            self._print_watched_expressions()
+            if self.watched_expressions
+            else print("  No watched expressions.")
+        )
+
+    def _move_stack(self, arg_str, step, direction):
+        """Moves the inspected frame by step*N, clamped to the ends of the stack."""
+        if not self._full_stack_at_stop:
+            print("No stack.")
+            return
+        try:
+            c = int(arg_str) if arg_str else 1
+        except ValueError:
+            print("Invalid count.")
+            return
+        idx = self._interaction_stack_idx
+        n_idx = max(0, min(len(self._full_stack_at_stop) - 1, idx + step * c))
+        if n_idx == idx:
+            print(f"Cannot move further {direction}.")
+            return
+        self._interaction_stack_idx = n_idx
+        self.interaction_frame = self._full_stack_at_stop[n_idx]
+        self.update_prompt()
+        self.print_current_location(self.interaction_frame, f"Frame {n_idx}")
+
+    def do_up_stack(self, arg_str):
+        """up [N]: Move N levels up call stack (older frame, higher index)."""
+        self._move_stack(arg_str, 1, "up")
+
+    def do_down_stack(self, arg_str):
+        """down [N]: Move N levels down call stack (newer frame, lower index)."""
+        self._move_stack(arg_str, -1, "down")
+
+    def do_watch_expr(self, arg):
+        """watch <expr>: Add expression to watch list."""
+        if not arg:
+            print("Expr required.")
+            return
+        if arg in self.watched_expressions:
+            print(f"Already watching: {arg}")
+        else:
+            try:
+                self.watched_expressions[arg] = compile(arg, "<watch>", "eval")
+            except _COMPILE_ERRORS as e:
+                print(f"{_R}Invalid expr '{arg}': {e}{_E}")
                 return
-            c = 1
-            idx = self._interaction_stack_idx
-            if arg_str:
-                try:
-                    c = int(arg_str)
-                except ValueError:
-                    print("Invalid count.")
-                    return
-            n_idx = idx + c
-            if 0 <= n_idx < len(self._full_stack_at_stop):
-                self._interaction_stack_idx = n_idx
-                self.interaction_frame = self._full_stack_at_stop[n_idx]
-                self.update_prompt()
-                self.print_current_location(self.interaction_frame, f"Frame {n_idx}")
+            print(f"Watching: {arg}")
+        self._print_watched_expressions()
+
+    def do_unwatch_expr(self, arg):
+        """unwatch <expr|idx>: Remove expression from watch list."""
+        if not arg:
+            print("Expr or idx required.")
+            return
+        try:
+            idx = int(arg)
+            if 0 <= idx < len(self.watched_expressions):
+                ex = list(self.watched_expressions)[idx]
+                del self.watched_expressions[ex]
+                print(f"Unwatched: {ex}")
             else:
-                print("Cannot move further up.")
-
-        def do_down_stack(self, arg_str):
-            """down [N]: Move N levels down call stack (newer frame, lower index)."""
-            if not self._full_stack_at_stop:
-                print("No stack.")
-                return
-            c = 1
-            idx = self._interaction_stack_idx
-            if arg_str:
-                try:
-                    c = int(arg_str)
-                except ValueError:
-                    print("Invalid count.")
-                    return
-            n_idx = idx - c
-            if 0 <= n_idx < len(self._full_stack_at_stop):
-                self._interaction_stack_idx = n_idx
-                self.interaction_frame = self._full_stack_at_stop[n_idx]
-                self.update_prompt()
-                self.print_current_location(self.interaction_frame, f"Frame {n_idx}")
+                print(f"Invalid idx: {idx}")
+        except ValueError:
+            if self.watched_expressions.pop(arg, None):
+                print(f"Unwatched: {arg}")
             else:
-                print("Cannot move further down.")
+                print(f"Not watching: {arg}")
 
-        def do_watch_expr(self, arg):
-            """watch <expr>: Add expression to watch list."""
-            if not arg:
-                print("Expr required.")
-                return
-            if arg not in self.watched_expressions:
-                self.watched_expressions.append(arg)
-                print(f"Watching: {arg}")
-            else:
-                print(f"Already watching: {arg}")
-            self._print_watched_expressions()
 
-        def do_unwatch_expr(self, arg):
-            """unwatch <expr|idx>: Remove expression from watch list."""
-            if not arg:
-                print("Expr or idx required.")
-                return
-            try:
-                idx = int(arg)
-                if 0 <= idx < len(self.watched_expressions):
-                    print(f"Unwatched: {self.watched_expressions.pop(idx)}")
-                else:
-                    print(f"Invalid idx: {idx}")
-            except ValueError:
-                if arg in self.watched_expressions:
-                    self.watched_expressions.remove(arg)
-                    print(f"Unwatched: {arg}")
-                else:
-                    print(f"Not watching: {arg}")
+def debug_function(obj_to_debug):
+    """
+    A decorator that enables a GDB-like debugger for the decorated function or method.
+    Activates upon function/method entry. If applied to a class, it currently does not
+    automatically decorate its methods; methods should be decorated individually.
+    """
 
-    if not (isfunction(obj_to_debug) or ismethod(obj_to_debug)):
+    if not isinstance(obj_to_debug, (FunctionType, MethodType)):
         return obj_to_debug
+    active = local()  # .debugging is True while this thread runs obj_to_debug
+    entry_code = obj_to_debug.__code__  # Bound once; the bootstrap tracer sees every call
 
+    @wraps(obj_to_debug)
     def actual_function_wrapper(*args, **kwargs):
-        active_trace_func = gettrace()
-        is_already_tracing_with_our_debugger = False
-        if (
-            active_trace_func
-            and hasattr(active_trace_func, "__self__")
-            and isinstance(active_trace_func.__self__, PyDebugger)
-            and active_trace_func.__name__ == "trace_dispatch"
-        ):
-            is_already_tracing_with_our_debugger = True
-
-        if is_already_tracing_with_our_debugger:
+        if getattr(active, "debugging", False):
+            # Re-entry (e.g. recursion) stays inside the session that is already open.
             return obj_to_debug(*args, **kwargs)
-        else:
-            original_trace_func = active_trace_func
-            debugger_instance_holder = [None]
+        original_trace_func = gettrace()
+        debugger_instance_holder = [None]
 
-            def _initial_trace_for_this_func_entry(frame, event, arg):
-                if event == "call" and frame.f_code == obj_to_debug.__code__:
+        def _initial_trace_for_this_func_entry(frame, event, arg):
+            if event == "call" and frame.f_code is entry_code:
+                dbg = debugger_instance_holder[0]
+                if not dbg:
                     dbg = PyDebugger(entry_exec_frame=frame)
                     debugger_instance_holder[0] = dbg
-                    return dbg.trace_dispatch(frame, event, arg)
-                return _initial_trace_for_this_func_entry
+                return dbg.trace_dispatch(frame, event, arg)
+            dbg = debugger_instance_holder[0]
+            if dbg and dbg._traces_callee(frame.f_code):
+                return dbg.trace_dispatch  # Same rule as _on_py_start; no call stop
+            return None  # Every other frame runs untraced
+
+        settrace(_initial_trace_for_this_func_entry)
+        active.debugging = True
+        result = None
+        try:
+            result = obj_to_debug(*args, **kwargs)
+        except Exception:
+            if not debugger_instance_holder[0]:
+                print(
+                    f"{_R}Critical: Debugger for {obj_to_debug.__name__} failed init.{_E}"
+                )
+            raise
+        finally:
+            active.debugging = False
+            # trace_dispatch is only ever a local tracer; after 'q' the global one is already None.
+            if gettrace() is _initial_trace_for_this_func_entry:
+                settrace(original_trace_func)
+        return result
+
+    @wraps(obj_to_debug)
+    def monitored_function_wrapper(*args, **kwargs):
+        if getattr(active, "debugging", False):
+            return obj_to_debug(*args, **kwargs)
+        if monitoring.get_tool(_MON_TOOL_ID) is not None:
+            # Tool id taken by another tool: use the settrace path instead.
+            return actual_function_wrapper(*args, **kwargs)
+        debugger_instance_holder = [None]
+
+        def _initial_event_for_this_func_entry(code, instruction_offset):
+            if code is entry_code and not debugger_instance_holder[0]:
+                frame = _getframe(1)
+                dbg = PyDebugger(entry_exec_frame=frame)
+                debugger_instance_holder[0] = dbg
+                dbg.start_monitoring(entry_code)
+                dbg.trace_dispatch(frame, "call", None)
+
+        monitoring.use_tool_id(_MON_TOOL_ID, "pydbg")
+        monitoring.register_callback(
+            _MON_TOOL_ID, _MON_EVENTS.PY_START, _initial_event_for_this_func_entry
+        )
+        monitoring.set_local_events(_MON_TOOL_ID, entry_code, _MON_EVENTS.PY_START)
+        active.debugging = True
+        try:
+            return obj_to_debug(*args, **kwargs)
+        except Exception:
+            if not debugger_instance_holder[0]:
+                print(
+                    f"{_R}Critical: Debugger for {obj_to_debug.__name__} failed init.{_E}"
+                )
+            raise
+        finally:
+            active.debugging = False
+            if debugger_instance_holder[0]:
+                debugger_instance_holder[0].stop_monitoring()
+            else:
+                monitoring.set_local_events(
+                    _MON_TOOL_ID, entry_code, _MON_EVENTS.NO_EVENTS
+                )
+                monitoring.register_callback(_MON_TOOL_ID, _MON_EVENTS.PY_START, None)
+                monitoring.free_tool_id(_MON_TOOL_ID)
 
-            settrace(_initial_trace_for_this_func_entry)
-            result = None
-            try:
-                result = obj_to_debug(*args, **kwargs)
-            except Exception:
-                if not debugger_instance_holder[0]:
-                    print(
-                        f"{_TermColors.FAIL}Critical: Debugger for {obj_to_debug.__name__} failed init.{_TermColors.ENDC}"
-                    )
-                raise
-            finally:
-                current_trace = gettrace()
-                if current_trace is _initial_trace_for_this_func_entry or (
-                    debugger_instance_holder[0]
-                    and hasattr(debugger_instance_holder[0], "trace_dispatch")
-                    and current_trace == debugger_instance_holder[0].trace_dispatch
-                ):
-                    settrace(original_trace_func)
-            return result
-
-    return actual_function_wrapper
+    return monitored_function_wrapper if _USE_MONITORING else actual_function_wrapper
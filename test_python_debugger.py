@@ -0,0 +1,319 @@
+"""
+Scripted tests for python_debugger: each case writes a small target script, runs it in a
+subprocess with debugger commands on stdin, and checks the transcript. Debugger cases run on
+both backends (sys.monitoring and the settrace fallback).
+
+Run with: python -m unittest test_python_debugger
+"""
+
+import subprocess
+import sys
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+REPO_DIR = path.dirname(path.abspath(__file__))
+
+# One line, so line 1 of a test body is line 2 of the target file.
+_PRELUDE = (
+    "import sys; sys.path.insert(0, {repo!r}); import python_debugger; "
+    "python_debugger._USE_MONITORING = {monitoring}; "
+    "from python_debugger import debug_function\n"
+)
+
+
+def run_debugger(body, commands, monitoring):
+    """Runs body under the debugger, feeding commands, and returns the transcript."""
+    with TemporaryDirectory() as tmp:
+        target = path.join(tmp, "target.py")
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(_PRELUDE.format(repo=REPO_DIR, monitoring=monitoring))
+            f.write(dedent(body).lstrip("\n"))
+        proc = subprocess.run(
+            [sys.executable, target],
+            input="\n".join(commands) + "\n",
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+    return proc.stdout + proc.stderr
+
+
+class _BackendTests:
+    monitoring = True
+
+    def run_debugger(self, body, commands):
+        return run_debugger(body, commands, self.monitoring)
+
+    def test_setvar_changes_running_frame(self):
+        out = self.run_debugger(
+            """
+            @debug_function
+            def main(x):
+                a = x + 1
+                b = a * 2
+                return b
+
+            print("RESULT", main(1))
+            """,
+            ["n", "n", "set a = 10", "c"],
+        )
+        self.assertIn("Set a=10", out)
+        self.assertIn("RESULT 20", out)
+
+    def test_breakpoint_in_undecorated_callee(self):
+        out = self.run_debugger(
+            """
+            def helper(v):
+                w = v * 2
+                return w + 1
+
+            @debug_function
+            def main(x):
+                a = x + 1
+                b = helper(a)
+                return a + b
+
+            print("RESULT", main(3))
+            """,
+            ["b 3", "c", "up", "set a = 100", "c"],
+        )
+        self.assertIn("BP 1 at:", out)
+        self.assertIn("(pydbg target.py:3 helper())", out)
+        self.assertIn("RESULT 109", out)
+
+    def test_breakpoint_by_name_stops_inside_an_undecorated_callee(self):
+        out = self.run_debugger(
+            """
+            def helper(v):
+                \"\"\"Doubles v, plus one.\"\"\"
+                w = v * 2
+                return w + 1
+
+            @debug_function
+            def main(x):
+                return helper(x)
+
+            print("RESULT", main(3))
+            """,
+            ["b helper", "c", "c"],
+        )
+        self.assertIn("Breakpoint 1 set at target.py:4", out)
+        self.assertIn("BP 1 at:\n Frame 0: target.py:4 helper()", out)
+        self.assertIn("RESULT 7", out)
+
+    def test_step_stops_on_each_pass_of_a_one_line_loop(self):
+        out = self.run_debugger(
+            """
+            @debug_function
+            def main():
+                t = 0
+                for i in range(3): t += i
+                return t
+
+            print("RESULT", main())
+            """,
+            ["s"] * 8 + ["c"],
+        )
+        self.assertEqual(out.count("Step at:\n Frame 0: target.py:5 main()"), 4)
+        self.assertIn("RESULT 3", out)
+
+    def test_step_off_a_callee_stops_at_the_callers_next_line(self):
+        body = """
+            def helper(v):
+                w = v * 2
+                return w + 1
+
+            @debug_function
+            def main(x):
+                a = x + 1
+                b = helper(a)
+                c = b + 1
+                return c
+
+            print("RESULT", main(3))
+            """
+        for step in ("s", "n"):
+            with self.subTest(step=step):
+                # The first step stops on helper's return, the second back in main.
+                out = self.run_debugger(body, ["b 4", "c", step, step, "c"])
+                self.assertIn(" at:\n Frame 0: target.py:10 main()", out)
+                self.assertNotIn("target.py:11 main()", out)
+                self.assertIn("RESULT 10", out)
+
+    _LOOP = """
+        def helper(v):
+            w = v * 2
+            return w + 1
+
+        @debug_function
+        def main(n):
+            t = 0
+            for i in range(n):
+                t += helper(i)
+            return t
+
+        print("RESULT", main(5))
+        """
+
+    def test_breakpoint_hits_on_every_pass(self):
+        out = self.run_debugger(self._LOOP, ["b 10"] + ["c"] * 6)
+        self.assertEqual(out.count("BP 1 at:\n Frame 0: target.py:10 main()"), 5)
+        self.assertIn("RESULT 25", out)
+
+    def test_conditional_breakpoint_stops_only_when_true(self):
+        out = self.run_debugger(self._LOOP, ["b 10 if i == 3", "c", "p i", "c"])
+        self.assertEqual(out.count("BP 1 at:"), 1)
+        self.assertIn("i = 3", out)
+        self.assertIn("RESULT 25", out)
+
+    def test_ignore_count_skips_hits(self):
+        out = self.run_debugger(
+            self._LOOP, ["b 10", "ignore 1 3", "c", "p i", "c", "c"]
+        )
+        self.assertEqual(out.count("BP 1 at:"), 2)
+        self.assertIn("i = 3", out)
+        self.assertIn("RESULT 25", out)
+
+    def test_next_steps_over_calls(self):
+        out = self.run_debugger(self._LOOP, ["b 10", "c", "n", "n", "c", "cl 1", "c"])
+        self.assertIn("Next at:\n Frame 0: target.py:9 main()", out)
+        self.assertNotIn("target.py:3 helper()", out)
+        self.assertIn("RESULT 25", out)
+
+    def test_breakpoint_table_is_in_id_order_and_drops_replaced_ids(self):
+        out = self.run_debugger(
+            self._LOOP, ["b 11", "b 3", "b 11 if t > 0", "cl 1", "cl 2", "c", "c"]
+        )
+        # The table after the replacement: ids 2 then 3, and id 1 is gone for good.
+        table = out.split("Breakpoints:")[3]
+        self.assertRegex(table, r"\n  2 .*target\.py:3\n  3 .*t > 0 .*target\.py:11\n\(pydbg")
+        self.assertNotIn("Breakpoint 1 cleared.", out)
+        self.assertIn("Breakpoint 2 cleared.", out)
+        self.assertIn("BP 3 at:\n Frame 0: target.py:11 main()", out)
+        self.assertIn("RESULT 25", out)
+
+    def test_up_and_down_clamp_to_the_stack(self):
+        out = self.run_debugger(
+            self._LOOP, ["b 3", "c", "up 99", "up", "down 99", "down", "cl 1", "c"]
+        )
+        up, down = out.split("Cannot move further up.")
+        self.assertIn("Frame 0: target.py:3 helper()", up)
+        self.assertIn("target.py:13 <module>() (inspecting frame", up)
+        self.assertIn("Frame 0 at:\n Frame 0: target.py:3 helper()", down)
+        self.assertIn("Cannot move further down.", down)
+        self.assertIn("RESULT 25", out)
+
+    def test_queued_break_and_clear_render_the_table_once(self):
+        out = self.run_debugger(
+            """
+            batch = ["b 3", "b 4", "cl 1", "b 5"]
+            python_debugger.PyDebugger.preloop = lambda self: (
+                self.cmdqueue.extend(batch), batch.clear()
+            )
+
+            @debug_function
+            def main(x):
+                a = x + 1
+                return a
+
+            print("RESULT", main(1))
+            """,
+            ["c"],
+        )
+        self.assertEqual(out.count("Breakpoints:"), 1)
+        self.assertIn("Breakpoint 1 cleared.", out)
+        self.assertIn("RESULT 2", out)
+
+    def test_uncompilable_condition_and_watch_are_rejected(self):
+        deep = "not " * 100000 + "1"  # MemoryError from the parser, not SyntaxError
+        out = self.run_debugger(
+            """
+            @debug_function
+            def main(x):
+                a = x + 1
+                return a
+
+            print("RESULT", main(1))
+            """,
+            [f"b 4 if {deep}", f"watch {deep}", "c"],
+        )
+        self.assertIn("Invalid BP condition", out)
+        self.assertIn("Invalid expr", out)
+        self.assertIn("RESULT 2", out)
+
+    def test_resume_releases_the_stepped_frame(self):
+        out = self.run_debugger(
+            """
+            class Tracked:
+                def __del__(self):
+                    print("FREED")
+
+            def helper():
+                t = Tracked()
+                return 1
+
+            @debug_function
+            def main():
+                helper()
+                print("AFTER")
+
+            main()
+            """,
+            ["b 7", "c", "n", "c"],
+        )
+        self.assertLess(out.index("FREED"), out.index("AFTER"))
+
+
+class MonitoringBackendTests(_BackendTests, unittest.TestCase):
+    monitoring = True
+
+    _COUNT_RESTARTS = """
+        restarts = []
+        _restart_events = sys.monitoring.restart_events
+        sys.monitoring.restart_events = lambda: (restarts.append(1), _restart_events())
+
+        @debug_function
+        def main():
+            t = 0
+            for i in range(5):
+                t += i
+            return t
+
+        print("RESULT", main(), "RESTARTS", len(restarts))
+        """
+
+    def test_restart_events_skipped_when_nothing_disabled_matters(self):
+        out = self.run_debugger(self._COUNT_RESTARTS, ["b 11", "c", "c", "c"])
+        self.assertIn("RESULT 10 RESTARTS 0", out)
+
+    def test_restart_events_when_stepping_after_lines_were_disabled(self):
+        out = self.run_debugger(self._COUNT_RESTARTS, ["b 11", "c", "n", "c", "c"])
+        self.assertIn("RESULT 10 RESTARTS 1", out)
+
+
+class SettraceBackendTests(_BackendTests, unittest.TestCase):
+    monitoring = False
+
+
+class ImportTests(unittest.TestCase):
+    def test_import_without_stdout(self):
+        # pythonw and detached daemons run with sys.stdout set to None.
+        proc = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                f"import sys; sys.stdout = None; sys.path.insert(0, {REPO_DIR!r}); "
+                "import python_debugger; sys.stderr.write(repr(python_debugger._G))",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stderr, "''")
+
+
+if __name__ == "__main__":
+    unittest.main()